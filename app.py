@@ -1,12 +1,36 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Optional, Dict
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Dict
 
-from flask import Flask, render_template, request, abort, url_for, redirect, session
+from flask import Flask, render_template, request, abort, url_for, redirect, session, g
 from pathlib import Path
-import json
+import hmac
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj, pretty: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else None)
+except ImportError:  # orjson es opcional: misma salida con la stdlib
+    import json
+
+    def _json_loads(raw: bytes):
+        return json.loads(raw)
+
+    def _json_dumps(obj, pretty: bool = False) -> bytes:
+        if pretty:
+            return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 from validation import validate_payment_form
 
@@ -18,7 +42,9 @@ app.secret_key = "dev-secret-change-me"
 BASE_DIR = Path(__file__).resolve().parent
 EVENTS_PATH = BASE_DIR / "data" / "events.json"
 USERS_PATH = BASE_DIR / "data" / "users.json"
-ORDERS_PATH = BASE_DIR / "data" / "orders.json"
+ORDERS_PATH = BASE_DIR / "data" / "orders.jsonl"
+# users.json se escribe compacto; EVENTHUB_PRETTY_JSON=1 lo deja indentado (debug).
+PRETTY_JSON = os.environ.get("EVENTHUB_PRETTY_JSON") == "1"
 CATEGORIES = ["All", "Music", "Tech", "Sports", "Business"]
 CITIES = ["Any", "New York", "San Francisco", "Berlin", "London", "Oakland", "San Jose"]
 
@@ -36,25 +62,97 @@ class Event:
     available_tickets: int
     banner_url: str
     description: str
+    # Derivados que usan los filtros; se calculan una vez al construir el evento.
+    _title_lc: str = field(init=False, repr=False, compare=False)
+    _venue_lc: str = field(init=False, repr=False, compare=False)
+    _start_ord: int = field(init=False, repr=False, compare=False)
 
-def _user_with_defaults(u: dict) -> dict:
-    u = dict(u)
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "_title_lc", self.title.lower())
+        object.__setattr__(self, "_venue_lc", self.venue.lower())
+        object.__setattr__(self, "_start_ord", self.start.toordinal())
+
+def _apply_user_defaults(u: dict) -> None:
     u.setdefault("role", "user")      
     u.setdefault("status", "active")  
     u.setdefault("locked_until", "") 
-    return u
+
+_MISSING = object()
+_DUMMY_PASSWORD = secrets.token_hex(16)
+
 
 def get_current_user() -> Optional[dict]:
-    email = session.get("user_email")
-    if not email:
-        return None
-    return find_user_by_email(email)
+    """Usuario de la sesión; se resuelve una sola vez por request (cache en g)."""
+    user = getattr(g, "_current_user", _MISSING)
+    if user is _MISSING:
+        email = session.get("user_email")
+        user = find_user_by_email(email) if email else None
+        g._current_user = user
+    return user
 
 
 
-def load_events() -> List[Event]:
-    data = json.loads(EVENTS_PATH.read_text(encoding="utf-8"))
-    return [
+# Cache de archivos JSON: path -> (st_mtime_ns, datos ya parseados).
+_cache_lock = threading.Lock()
+_file_cache: Dict[Path, tuple] = {}
+
+
+def _load_json_cached(path: Path, build):
+    """Devuelve build(json del archivo), re-parseando solo si cambió su mtime."""
+    mtime = path.stat().st_mtime_ns
+    with _cache_lock:
+        cached = _file_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            data = _json_loads(path.read_bytes())
+            cached = (mtime, build(data))
+            _file_cache[path] = cached
+        return cached[1]
+
+
+def _invalidate_cache(path: Path) -> None:
+    with _cache_lock:
+        _file_cache.pop(path, None)
+
+
+def _atomic_write(path: Path, payload: bytes) -> None:
+    """Escribe a un temporal propio en el mismo directorio y lo reemplaza atómicamente.
+
+    Cada escritura usa su propio archivo (mkstemp), así dos requests que
+    guardan a la vez no se pisan el .tmp; si algo falla, el temporal se borra.
+
+    Las rutas modifican los objetos cacheados antes de guardar, así que el
+    cache se descarta siempre, también si la escritura falla: la próxima
+    lectura vuelve a lo que realmente quedó en disco.
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        if path.exists():  # mkstemp crea con 0600; se conservan los permisos
+            shutil.copymode(path, tmp)
+        with os.fdopen(fd, "wb", buffering=65536) as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    finally:
+        _invalidate_cache(path)
+
+
+def _build_events(data: list) -> tuple[
+    List[Event], Dict[int, Event], Dict[tuple[str, str], tuple[Event, ...]]
+]:
+    """Lista de eventos + índices por id y por (categoría, ciudad).
+
+    El índice por (categoría, ciudad) incluye también las claves comodín
+    "All"/"Any", de modo que cualquier combinación de filtros es un solo get,
+    y cada bucket ya viene ordenado por fecha de inicio.
+    """
+    events = [
         Event(
             id=int(e["id"]),
             title=e["title"],
@@ -70,9 +168,36 @@ def load_events() -> List[Event]:
         )
         for e in data
     ]
+    by_id: Dict[int, Event] = {}
+    for e in events:
+        by_id.setdefault(e.id, e)
+    by_cat_city: Dict[tuple[str, str], list[Event]] = {}
+    for e in sorted(events, key=lambda e: e.start):
+        for key in ((e.category, e.city), (e.category, "Any"), ("All", e.city), ("All", "Any")):
+            by_cat_city.setdefault(key, []).append(e)
+    return events, by_id, {k: tuple(v) for k, v in by_cat_city.items()}
+
+
+def load_events() -> List[Event]:
+    return _load_json_cached(EVENTS_PATH, _build_events)[0]
+
+
+def find_event_by_id(event_id: int) -> Optional[Event]:
+    return _load_json_cached(EVENTS_PATH, _build_events)[1].get(event_id)
+
+
+def events_for(category: str = "All", city: str = "Any") -> tuple[Event, ...]:
+    """Eventos de una categoría/ciudad ("All"/"Any" = sin filtrar)."""
+    return _load_json_cached(EVENTS_PATH, _build_events)[2].get((category, city), ())
 
 
-EVENTS: List[Event] = load_events()
+# Precarga el catálogo al importar; luego load_events() solo re-lee si cambia el archivo.
+load_events()
+
+
+def similar_events(event: Event, limit: int = 5) -> List[Event]:
+    """Otros eventos de la misma categoría (usa el índice por categoría)."""
+    return [e for e in events_for(event.category) if e.id != event.id][:limit]
 
 
 def _parse_date(date_str: str) -> Optional[datetime]:
@@ -87,10 +212,13 @@ def _parse_date(date_str: str) -> Optional[datetime]:
 
 def _safe_int(value: str, default: int = 1, min_v: int = 1, max_v: int = 10) -> int:
     """Validación simple de enteros para inputs (cantidad, etc.)."""
-    try:
-        n = int(value)
-    except (TypeError, ValueError):
+    s = (value or "").strip()
+    if not s.isdecimal():
         return default
+    # Sin ceros a la izquierda, más de 18 dígitos ya está por encima del máximo
+    # (y int() rechaza más de 4300 dígitos).
+    s = s.lstrip("0") or "0"
+    n = int(s) if len(s) <= 18 else max_v
     return max(min_v, min(max_v, n))
 
 
@@ -104,73 +232,172 @@ def filter_events(
     city_norm = (city or "Any").strip()
     category_norm = (category or "All").strip()
 
-    results = load_events()
+    return list(_filter_events_cached(
+        q_norm, city_norm, date, category_norm, EVENTS_PATH.stat().st_mtime_ns
+    ))
 
-    if category_norm != "All":
-        results = [e for e in results if e.category == category_norm]
 
-    if city_norm != "Any":
-        results = [e for e in results if e.city == city_norm]
+@lru_cache(maxsize=256)
+def _filter_events_cached(
+    q_norm: str,
+    city_norm: str,
+    date: Optional[datetime],
+    category_norm: str,
+    events_mtime: int,
+) -> tuple[Event, ...]:
+    """Resultado memoizado por filtros normalizados + mtime de events.json."""
+    results = events_for(category_norm, city_norm)
 
     if date:
+        day = date.toordinal()
         results = [
             e for e in results
-            if e.start.date() == date.date()
+            if e._start_ord == day
         ]
 
     if q_norm:
         results = [
             e for e in results
-            if q_norm in e.title.lower() or q_norm in e.venue.lower()
+            if q_norm in e._title_lc or q_norm in e._venue_lc
         ]
 
-    results.sort(key=lambda e: e.start)
-    return results
+    return tuple(results)
 
 
 def get_event_or_404(event_id: int) -> Event:
-    for e in EVENTS:
-        if e.id == event_id:
-            return e
-    abort(404)
+    event = find_event_by_id(event_id)
+    if not event:
+        abort(404)
+    return event
 
 
-def load_users() -> list[dict]:
+def normalize_email(email: Optional[str]) -> str:
+    """Forma canónica del email: se guarda así y se usa como clave de búsqueda."""
+    return (email or "").strip().casefold()
+
+
+class UsersIndex(NamedTuple):
+    users: list[dict]
+    by_email: Dict[str, dict]
+    by_id: Dict[int, dict]
+    # Vista del panel admin: (nombre_lc, email_lc, usuario), ordenada por nombre e id.
+    admin_rows: List[tuple[str, str, dict]]
+    max_id: int
+
+
+def _build_users(users: list[dict]) -> UsersIndex:
+    """Lista de usuarios + índices por email normalizado y por id.
+
+    Completa los campos por defecto (role/status/locked_until) una sola vez y
+    arma la vista del panel admin (ordenada por nombre e id) para no copiar
+    ni ordenar en cada request. El id máximo se recalcula en cada recarga, así
+    next_user_id() ve también los usuarios agregados a mano al archivo.
+    """
+    by_email: Dict[str, dict] = {}
+    by_id: Dict[int, dict] = {}
+    for u in users:
+        _apply_user_defaults(u)
+        by_email.setdefault(normalize_email(u.get("email")), u)
+        by_id.setdefault(int(u.get("id", 0)), u)
+    admin_rows = sorted(
+        ((u.get("full_name","").lower(), u.get("email","").lower(), u) for u in users),
+        key=lambda r: (r[0], r[2].get("id", 0)),
+    )
+    return UsersIndex(users, by_email, by_id, admin_rows, max(by_id, default=0))
+
+
+def _load_users_indexed() -> UsersIndex:
     if not USERS_PATH.exists():
         USERS_PATH.parent.mkdir(parents=True, exist_ok=True)
         USERS_PATH.write_text("[]", encoding="utf-8")
-    return json.loads(USERS_PATH.read_text(encoding="utf-8"))
+    return _load_json_cached(USERS_PATH, _build_users)
+
+
+def load_users() -> list[dict]:
+    return _load_users_indexed().users
 
 
 def save_users(users: list[dict]) -> None:
-    USERS_PATH.write_text(json.dumps(users, indent=2), encoding="utf-8")
+    _atomic_write(USERS_PATH, _json_dumps(users, pretty=PRETTY_JSON))
 
 
 def find_user_by_email(email: str) -> Optional[dict]:
-    users = load_users()
-    email_norm = (email or "").strip().lower()
-    for u in users:
-        if (u.get("email", "") or "").strip().lower() == email_norm:
-            return u
-    return None
+    return _load_users_indexed().by_email.get(normalize_email(email))
+
+
+def find_user_by_id(user_id: int) -> Optional[dict]:
+    return _load_users_indexed().by_id.get(user_id)
 
 
 def user_exists(email: str) -> bool:
     return find_user_by_email(email) is not None
 
-def load_orders() -> list[dict]:
+def _ensure_orders_file() -> None:
     if not ORDERS_PATH.exists():
         ORDERS_PATH.parent.mkdir(parents=True, exist_ok=True)
-        ORDERS_PATH.write_text("[]", encoding="utf-8")
-    return json.loads(ORDERS_PATH.read_text(encoding="utf-8"))
-
-
-def save_orders(orders: list[dict]) -> None:
-    ORDERS_PATH.write_text(json.dumps(orders, indent=2), encoding="utf-8")
-
-
-def next_order_id(orders: list[dict]) -> int:
-    return max([o.get("id", 0) for o in orders], default=0) + 1
+        ORDERS_PATH.touch()
+
+
+def append_order(order: dict) -> None:
+    """Agrega una orden al final de orders.jsonl sin reescribir el archivo."""
+    _ensure_orders_file()
+    line = _json_dumps(order) + b"\n"
+    with open(ORDERS_PATH, "a+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size:
+            f.seek(size - 1)
+            # Última línea cortada (escritura interrumpida o edición a mano):
+            # se cierra antes, para no pegar la orden nueva a ella.
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+
+
+# Últimos ids asignados en este proceso. Cada id nuevo es mayor que este valor
+# y que el máximo del archivo, así no se repiten ids agregados a mano.
+_last_order_id = 0
+_last_user_id = 0
+# orders.jsonl es append-only: (bytes ya leídos, id máximo visto en ellos).
+_orders_scan = (0, 0)
+# Lock propio: el recorrido de orders.jsonl no bloquea el cache de eventos/usuarios.
+_orders_lock = threading.Lock()
+
+
+def _scan_orders(offset: int, max_id: int) -> tuple[int, int]:
+    """Lee las líneas completas de orders.jsonl desde offset y actualiza el id máximo.
+
+    Las líneas que no son JSON válido o no tienen un id entero se ignoran.
+    """
+    with open(ORDERS_PATH, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # línea aún sin terminar: se lee en la próxima llamada
+            offset += len(line)
+            try:
+                order_id = _json_loads(line)["id"]
+            except (ValueError, TypeError, KeyError):
+                continue
+            if isinstance(order_id, int) and not isinstance(order_id, bool):
+                max_id = max(max_id, order_id)
+    return offset, max_id
+
+
+def next_order_id() -> int:
+    global _last_order_id, _orders_scan
+    _ensure_orders_file()
+    with _orders_lock:
+        _orders_scan = _scan_orders(*_orders_scan)
+        _last_order_id = max(_last_order_id, _orders_scan[1]) + 1
+        return _last_order_id
+
+
+def next_user_id() -> int:
+    global _last_user_id
+    max_id = _load_users_indexed().max_id
+    with _cache_lock:
+        _last_user_id = max(_last_user_id, max_id) + 1
+        return _last_user_id
 
 
 # -----------------------------
@@ -204,11 +431,9 @@ def index():
 
 @app.get("/event/<int:event_id>")
 def event_detail(event_id: int):
-    event = next((e for e in load_events() if e.id == event_id), None)
-    if not event:
-        abort(404)
+    event = get_event_or_404(event_id)
 
-    similar = [e for e in EVENTS if e.category == event.category and e.id != event.id][:5]
+    similar = similar_events(event)
 
     return render_template(
         "event_detail.html",
@@ -223,7 +448,7 @@ def buy_ticket(event_id: int):
     qty = _safe_int(request.form.get("qty", "1"), default=1, min_v=1, max_v=8)
 
     if qty > event.available_tickets:
-        similar = [e for e in load_events() if e.category == event.category and e.id != event.id][:5]
+        similar = similar_events(event)
         return render_template(
             "event_detail.html",
             event=event,
@@ -260,7 +485,11 @@ def login():
         ), 400
 
     user = find_user_by_email(email)
-    if not user or user.get("password") != password:
+    # Siempre se compara (contra un valor dummy si el usuario no existe) y en
+    # tiempo constante, para no revelar por timing qué emails están registrados.
+    stored = (user or {}).get("password") or _DUMMY_PASSWORD
+    password_ok = hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+    if not user or not password_ok:
         return render_template(
             "login.html",
             error="Invalid credentials.",
@@ -268,7 +497,7 @@ def login():
             form={"email": email},
         ), 401
 
-    session["user_email"] = (user.get("email") or "").strip().lower()
+    session["user_email"] = normalize_email(user.get("email"))
 
     return redirect(url_for("dashboard"))
 
@@ -290,12 +519,12 @@ def register():
         ), 400
 
     users = load_users()
-    next_id = (max([u.get("id", 0) for u in users], default=0) + 1)
+    next_id = next_user_id()
 
     users.append({
         "id": next_id,
         "full_name": full_name,
-        "email": email,
+        "email": normalize_email(email),
         "phone": phone,
         "password": password,
         "role": "user",          
@@ -318,10 +547,7 @@ def dashboard():
 def checkout(event_id: int):
 
 
-    events = load_events()
-    event = next((e for e in events if e.id == event_id), None)
-    if not event:
-        abort(404)
+    event = get_event_or_404(event_id)
 
     qty = _safe_int(request.args.get("qty", "1"), default=1, min_v=1, max_v=8)
 
@@ -355,11 +581,13 @@ def checkout(event_id: int):
         billing_email=billing_email
     )
 
+    # Del número de tarjeta solo se conservan los últimos 4 dígitos: form_data
+    # se guarda tal cual en la orden y nunca debe llevar el número completo.
     form_data = {
         "exp_date": clean.get("exp_date", ""),
         "name_on_card": clean.get("name_on_card", ""),
         "billing_email": clean.get("billing_email", ""),
-        "card": clean.get("card", "")
+        "card_last4": clean.get("card", "")[-4:]
     }
 
     if errors:
@@ -370,10 +598,9 @@ def checkout(event_id: int):
             errors=errors, form_data=form_data
         ), 400
 
-    orders = load_orders()
-    order_id = next_order_id(orders)
+    order_id = next_order_id()
 
-    orders.append({
+    append_order({
         "id": order_id,
         "user_email": "PLACEHOLDER@EMAIL.COM",
         "event_id": event.id,
@@ -387,8 +614,6 @@ def checkout(event_id: int):
         "payment": form_data
     })
 
-    save_orders(orders)
-
     return redirect(url_for("dashboard", paid="1"))
 
 
@@ -419,19 +644,14 @@ def profile():
         new_password = request.form.get("new_password", "")
         confirm_new_password = request.form.get("confirm_new_password", "")
 
-        users = load_users()
-        email_norm = (user.get("email") or "").strip().lower()
-
-        for u in users:
-            if (u.get("email") or "").strip().lower() == email_norm:
-                u["full_name"] = full_name
-                u["phone"] = phone
-
-                if new_password:
-                    u["password"] = new_password
-                break
+        changes = {"full_name": full_name, "phone": phone}
+        if new_password:
+            changes["password"] = new_password
 
-        save_users(users)
+        u = find_user_by_email(user.get("email"))
+        if u and any(u.get(k) != v for k, v in changes.items()):
+            u.update(changes)
+            save_users(load_users())
 
         form["full_name"] = full_name
         form["phone"] = phone
@@ -451,14 +671,12 @@ def admin_users():
     status = (request.args.get("status") or "all").strip().lower()
     lockout = (request.args.get("lockout") or "all").strip().lower()
 
-    users = [_user_with_defaults(u) for u in load_users()]
+    rows = _load_users_indexed().admin_rows
 
     # filtros
     if q:
-        users = [
-            u for u in users
-            if q in (u.get("full_name","").lower()) or q in (u.get("email","").lower())
-        ]
+        rows = [r for r in rows if q in r[0] or q in r[1]]
+    users = [u for _, _, u in rows]
 
     if role != "all":
         users = [u for u in users if (u.get("role","user").lower() == role)]
@@ -472,8 +690,6 @@ def admin_users():
         elif lockout == "not_locked":
             users = [u for u in users if not (u.get("locked_until") or "").strip()]
 
-    users.sort(key=lambda u: (u.get("full_name","").lower(), u.get("id", 0)))
-
     return render_template(
         "admin_users.html",
         users=users,
@@ -483,25 +699,20 @@ def admin_users():
 
 @app.post("/admin/users/<int:user_id>/toggle")
 def admin_toggle_user(user_id: int):
-    users = load_users()
-    for u in users:
-        if int(u.get("id", 0)) == user_id:
-            u.setdefault("status", "active")
-            u["status"] = "disabled" if u["status"] == "active" else "active"
-            break
-    save_users(users)
+    u = find_user_by_id(user_id)
+    if u:
+        u["status"] = "disabled" if u["status"] == "active" else "active"
+        save_users(load_users())
     return redirect(url_for("admin_users"))
 
 @app.post("/admin/users/<int:user_id>/role")
 def admin_change_role(user_id: int):
     new_role = request.form.get("role", "user")
 
-    users = load_users()
-    for u in users:
-        if int(u.get("id", 0)) == user_id:
-            u["role"] = new_role
-            break
-    save_users(users)
+    u = find_user_by_id(user_id)
+    if u and u.get("role") != new_role:
+        u["role"] = new_role
+        save_users(load_users())
     return redirect(url_for("admin_users"))
 
 if __name__ == "__main__":
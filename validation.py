@@ -39,8 +39,13 @@ NAME_ALLOWED_RE = re.compile(r"")    # allowed name characters
 def normalize_basic(value: str) -> str:
     """
     Normalize input using NFKC and strip whitespace.
+
+    NFKC leaves ASCII unchanged, so pure-ASCII input skips it.
     """
-    return unicodedata.normalize("NFKC", (value or "")).strip()
+    s = (value or "").strip()
+    if s.isascii():
+        return s
+    return unicodedata.normalize("NFKC", s).strip()
 
 
 def luhn_is_valid(number: str) -> bool: